@@ -12,7 +12,8 @@ if [[ "$FLASK_ENV" != "production" ]]; then
     flask run
 else
     WORKERS=4
+    # Green-thread workers: requests waiting on /job results or OpenDota don't hold a whole worker
     FLASK_ENV=$FLASK_ENV \
     LOGURU_LEVEL=INFO \
-    gunicorn -w $WORKERS --chdir $(pwd)/src "server:app" -b 0.0.0.0:8000
+    gunicorn -w $WORKERS -k eventlet --worker-connections 1000 --chdir $(pwd)/src "server:app" -b 0.0.0.0:8000
 fi
@@ -1 +1,19 @@
-PYTHONPATH=src celery -A async_parser worker -l INFO
\ No newline at end of file
+# Usage: run_workers.sh [network|parser], starts both workers when the queue is omitted
+QUEUE=${1:-all}
+
+if [[ "$QUEUE" == "network" ]]; then
+    # Network-bound downloads: the thread pool carries many concurrent requests,
+    # bz2 decompression releases the GIL, so it doesn't stall the other downloads
+    PYTHONPATH=src exec celery -A async_parser worker -l INFO -P threads -c 32 -Q network -n network@%h
+elif [[ "$QUEUE" == "parser" ]]; then
+    # Parsing with Clarity stays on the default queue with the prefork pool
+    PYTHONPATH=src exec celery -A async_parser worker -l INFO -Q celery -n parser@%h
+else
+    bash "$0" network &
+    bash "$0" parser &
+    # Exit as soon as either worker dies instead of silently running half of the pipeline
+    wait -n
+    STATUS=$?
+    kill $(jobs -p) 2>/dev/null
+    exit $STATUS
+fi
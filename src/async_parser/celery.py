@@ -11,6 +11,11 @@ app = Celery(
     accept=['json']
 )
 
+# Downloads wait on the network and run in the thread pool of their own worker, see scripts/run_workers.sh
+app.conf.task_routes = {
+    'async_parser.tasks.download_save': {'queue': 'network'},
+}
+
 
 if __name__ == '__main__':
     app.start()
@@ -1,24 +1,42 @@
 import os
-import subprocess
-from bz2 import decompress
-from typing import Any
+import tempfile
+from typing import Any, Dict
 
+import orjson
+import redis
 import requests
-from celery import chain
+from celery import chain, group
+from celery.canvas import Signature
+from celery.utils import uuid
 from loguru import logger
 
 from .celery import app
-from settings import REPLAY_DIR, CLARITY_HOST, CLARITY_PORT
+from settings import REPLAY_DIR, REDIS_URL, CLARITY_HOST, CLARITY_PORT
+from dota import EVENT_FIELDS, Match, NotParsedError
+from downloads import SESSION, download_to
 
 
-def download(url: str) -> bytes:
-    logger.info(f'Downloading: {url}...')
-    r = requests.get(url)
-    r.raise_for_status()
-    compressed_dem = r.content
-    logger.info(f'Decompressing: {url}...')
-    dem = decompress(compressed_dem)
-    return dem
+# Action moments of a parsed replay never change, they are cached until the jsonlines file is rewritten
+HIGHLIGHTS_TTL = 30 * 24 * 60 * 60
+REDIS = redis.Redis.from_url(REDIS_URL)
+
+
+def highlights_cache_key(match_id: int) -> str:
+    mtime = os.path.getmtime(os.path.join(REPLAY_DIR, f'{match_id}.jsonlines'))
+    return f'dota:highlights:{match_id}:{mtime}'
+
+
+def get_cached_highlights(match_id: int) -> bytes | None:
+    """JSON of compute_highlights result if the parsed match is cached"""
+    return REDIS.get(highlights_cache_key(match_id))
+
+
+# Id of the job computing highlights of a match, so polling clients don't start duplicate pipelines
+PENDING_TTL = 60 * 60
+
+
+def pending_job_key(match_id: int) -> str:
+    return f'dota:pending:{match_id}'
 
 
 @app.task()
@@ -33,9 +51,7 @@ def download_save(url: str) -> str:
         logger.info(f'Dem file already exists: {path}...')
         return path
 
-    dem = download(url)
-    with open(path, 'wb') as fout:
-        fout.write(dem)
+    download_to(url, path)
     logger.info(f'Saved to {path}...')
     return path
 
@@ -49,13 +65,36 @@ def parse(dem_path: str, remove_dem: bool = False) -> str:
     jsonlines_path = dem_path.replace('.dem', '.jsonlines')
 
     logger.info(f'Parsing {jsonlines_path}...')
-    cmd = f'curl {CLARITY_HOST}:{CLARITY_PORT} --data-binary "@{dem_path}" > {jsonlines_path}'
-    subprocess.run(cmd, shell=True)
+    clarity_url = f'http://{CLARITY_HOST}:{CLARITY_PORT}'
+    # The server treats an existing jsonlines file as parsed, so it only appears once complete
+    fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(jsonlines_path))
+    try:
+        with open(fd, 'wb', buffering=1 << 20) as fout, open(dem_path, 'rb') as body, \
+                SESSION.post(clarity_url, data=body, stream=True, timeout=(5, 600)) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(1 << 20):
+                if not line:
+                    continue
+                e = orjson.loads(line)
+                fields = EVENT_FIELDS.get(e.get('type'))
+                if fields is None:
+                    continue
+                fout.write(orjson.dumps({field: e[field] for field in fields if field in e}))
+                fout.write(b'\n')
+    except (requests.RequestException, orjson.JSONDecodeError) as err:
+        os.remove(tmp_path)
+        raise ClarityParserException(
+            f'Clarity parsing failed for: {dem_path}...\n{err}\nDid you forget to run odota/parser?') from err
+    except BaseException:
+        os.remove(tmp_path)
+        raise
 
-    if os.path.getsize(jsonlines_path) == 0:
-        os.remove(jsonlines_path)
+    if os.path.getsize(tmp_path) == 0:
+        os.remove(tmp_path)
         raise ClarityParserException(
             f'Result file is empty: {jsonlines_path}...\nDid you forget to run odota/parser?')
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, jsonlines_path)
 
     if os.path.exists(dem_path) and remove_dem:
         logger.info(f'Removing temporary file {dem_path}...')
@@ -63,12 +102,64 @@ def parse(dem_path: str, remove_dem: bool = False) -> str:
     return jsonlines_path
 
 
+@app.task()
+def compute_highlights(match_id: int) -> Dict:
+    try:
+        match = Match.from_id(match_id)
+        match.parse()
+        highlights = dict(
+            success=True,
+            data=match.get_action_moments(),
+        )
+    except NotParsedError as err:
+        REDIS.delete(pending_job_key(match_id))
+        return dict(
+            success=False,
+            error=str(err),
+        )
+
+    REDIS.set(highlights_cache_key(match_id), orjson.dumps(highlights), ex=HIGHLIGHTS_TTL)
+    REDIS.delete(pending_job_key(match_id))
+    return highlights
+
+
+@app.task()
+def release_pending_job(match_id: int):
+    REDIS.delete(pending_job_key(match_id))
+
+
+def download_parse_pipeline(url: str) -> Signature:
+    return chain(download_save.s(url), parse.s(True))
+
+
 def download_parse_save(url: str) -> Any:
-    res = chain(download_save.s(url), parse.s(True))()
+    res = download_parse_pipeline(url).apply_async()
     return res
 
 
-def parse_from_file():
+def start_highlights_job(match_id: int, url: str = None) -> str:
+    """
+    Id of the job computing highlights of the match, downloading and parsing the replay first if url is given.
+    A new job is started only if none is in flight for the match.
+    """
+    key = pending_job_key(match_id)
+    job_id = uuid()
+    while not REDIS.set(key, job_id, nx=True, ex=PENDING_TTL):
+        pending_job_id = REDIS.get(key)
+        if pending_job_id is not None:
+            return pending_job_id.decode()
+
+    # Immutable signatures: highlights are computed by match id, not from the parsed file path
+    on_error = release_pending_job.si(match_id)
+    if url is None:
+        compute_highlights.apply_async((match_id,), task_id=job_id, link_error=on_error)
+    else:
+        chain(download_parse_pipeline(url), compute_highlights.si(match_id)).apply_async(
+            task_id=job_id, link_error=on_error)
+    return job_id
+
+
+def parse_from_file() -> Any:
     urls = []
     urls_path = os.path.join(REPLAY_DIR, 'urls.txt')
     with open(urls_path, 'r') as fin:
@@ -76,5 +167,6 @@ def parse_from_file():
             urls.append(line.replace('\n', ''))
     logger.info(f'Match URLs to Parse: {len(urls)}')
 
-    for url in urls:
-        download_parse_save(url)
+    # One group publishes all pipelines in a single dispatch instead of a broker round-trip per URL
+    res = group([download_parse_pipeline(url) for url in urls]).apply_async()
+    return res
@@ -1,23 +1,26 @@
 from typing import List, Dict
 
+import numpy as np
+import pandas as pd
+
 import dota
-from utils import convert_binary_mask_to_intervals, merge_close_intervals, has_intersection
+from utils import convert_flags_to_intervals, merge_close_intervals, has_intersection
 from settings import HP_RATE_THRESHOLD, MAX_HP_THRESHOLD, MERGE_GAP, DHP_SMOOTH_WINDOW
 
 
 def find_hp_decreasing_intervals(player: 'dota.MatchPlayer') -> List[Dict]:
     """Signal with intervals where player has negative hp diff"""
-    binary_mask = player.sdhp < HP_RATE_THRESHOLD
-    intervals = convert_binary_mask_to_intervals(binary_mask)
+    binary_mask = player.sdhp.to_numpy() < HP_RATE_THRESHOLD
+    intervals = convert_flags_to_intervals(player.hp.index.to_numpy(), binary_mask)
     intervals = merge_close_intervals(intervals, MERGE_GAP)
     return intervals
 
 
 def find_low_hp_intervals(player: 'dota.MatchPlayer') -> List[Dict]:
     """Signal with intervals where player has low hp"""
-    series = player.hp / player.max_hp
-    binary_mask = series < MAX_HP_THRESHOLD
-    intervals = convert_binary_mask_to_intervals(binary_mask)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        binary_mask = player.hp.to_numpy() / player.max_hp.to_numpy() < MAX_HP_THRESHOLD
+    intervals = convert_flags_to_intervals(player.hp.index.to_numpy(), binary_mask)
     intervals = merge_close_intervals(intervals, MERGE_GAP)
     return intervals
 
@@ -32,7 +35,9 @@ def find_low_and_decreasing_hp_intervals(player: 'dota.MatchPlayer') -> List[Dic
             if hp_decreasing_interval['end'] < low_hp_interval['start']:
                 break
             if has_intersection(hp_decreasing_interval, low_hp_interval):
+                # Listed once even if hp was low several times within it, find_attacks shifts each item in place
                 low_and_decreasing_hp_intervals.append(hp_decreasing_interval)
+                break
     return low_and_decreasing_hp_intervals
 
 
@@ -40,20 +45,28 @@ def find_attacks(player: 'dota.MatchPlayer') -> List[Dict]:
     """Intervals where player was attecked"""
     match = player.match
     intervals = find_low_and_decreasing_hp_intervals(player)
-    for interval in intervals:
-        is_dead = player.deaths.t(interval['start'], interval['end']).shape[0]
-        if is_dead:
-            interval['target_dead'] = True
-        else:
-            interval['target_dead'] = False
-
-        df_input_damage = player.hero_damage_in.t(interval['start'], interval['end'])
-        attacker_heroes = df_input_damage['sourcename'].unique()
-        converted_to_players = []
-        for hero_name in attacker_heroes:
-            hero_player = match.get_player(hero_name)
-            converted_to_players.append(hero_player)
-        interval['attacker_heroes'] = converted_to_players
+    if not intervals:
+        return intervals
+
+    starts = np.array([interval['start'] for interval in intervals])
+    ends = np.array([interval['end'] for interval in intervals])
+
+    # Once sorted by time, each interval maps to one contiguous slice of event rows
+    death_times = np.sort(player.deaths['time'].to_numpy())
+    n_deaths = np.searchsorted(death_times, ends, 'right') - np.searchsorted(death_times, starts, 'left')
+
+    damage_in = player.hero_damage_in
+    order = np.argsort(damage_in['time'].to_numpy(), kind='stable')
+    damage_times = damage_in['time'].to_numpy()[order]
+    damage_sources = damage_in['sourcename'].to_numpy()[order]
+    lo = np.searchsorted(damage_times, starts, 'left')
+    hi = np.searchsorted(damage_times, ends, 'right')
+
+    players_by_hero = {hero_name: match.get_player(hero_name) for hero_name in pd.unique(damage_sources)}
+    for i, interval in enumerate(intervals):
+        interval['target_dead'] = bool(n_deaths[i])
+        attacker_heroes = pd.unique(damage_sources[lo[i]:hi[i]])
+        interval['attacker_heroes'] = [players_by_hero[hero_name] for hero_name in attacker_heroes]
         interval['start'] -= DHP_SMOOTH_WINDOW
         interval['end'] -= DHP_SMOOTH_WINDOW
     return intervals
@@ -0,0 +1,44 @@
+import os
+import tempfile
+from bz2 import BZ2Decompressor
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# One pooled session per process: OpenDota and Valve replay hosts are hit repeatedly,
+# so keep-alive connections save a TCP + TLS handshake on every call
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+
+def download_to(url: str, path: str, chunk_size: int = 1 << 20) -> str:
+    """Streams the compressed replay and decompresses it chunk by chunk straight to disk"""
+    logger.info(f'Downloading: {url}...')
+    decompressor = BZ2Decompressor()
+    # Unique temporary file: concurrent downloads of the same replay must not share it, mkstemp makes it 0600
+    fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(path))
+    try:
+        with open(fd, 'wb', buffering=chunk_size) as fout, SESSION.get(url, stream=True, timeout=(5, 120)) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size):
+                dem = decompressor.decompress(chunk)
+                if dem:
+                    fout.write(dem)
+        if not decompressor.eof:
+            raise EOFError(f'Compressed replay is truncated: {url}')
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    # Rename only a complete file, callers treat any existing .dem as done
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+    return path
@@ -1,14 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
 import requests
+from celery.exceptions import TimeoutError as JobTimeoutError
 from flask import Flask, Response, request, jsonify
 from loguru import logger
 
-from async_parser.tasks import download_parse_save
+from async_parser.tasks import download_parse_save, get_cached_highlights, start_highlights_job
 from async_parser.celery import app as celery_app
-from dota import Match, NotParsedError
+from settings import REPLAY_DIR
+from downloads import SESSION
 
 
 app = Flask(__name__)
 
+# Replay URLs that answered HEAD recently, files on Valve servers rarely appear or disappear within minutes
+REPLAY_CHECK_TTL = 300
+REPLAY_CHECK_MAXSIZE = 10_000
+# Ordered by check time, so expired and oldest entries are at the front
+_replay_checked_at: OrderedDict[str, float] = OrderedDict()
+# Request threads share the cache, reordering and eviction are not atomic
+_replay_checked_at_lock = threading.Lock()
+# Longest a /job request waits for the result, clients poll again while the job is pending
+JOB_WAIT_TIMEOUT = 20
+
+
+class ReplayNotFoundError(Exception):
+    pass
+
+
+@lru_cache(maxsize=10_000)
+def fetch_replay_info(match_id: int) -> tuple[int, int]:
+    """(cluster, replay_salt) of the match from OpenDota, both never change once the match is over"""
+    r = SESSION.get(
+        'https://api.opendota.com/api/replays/',
+        params=dict(match_id=match_id),
+        timeout=(5, 60),
+    )
+    r.raise_for_status()
+    replay = r.json()
+    if not replay:
+        raise ReplayNotFoundError(f'Replay not found for the Match ID: {match_id}')
+    return replay[0]['cluster'], replay[0]['replay_salt']
+
+
+def remember_replay_check(url: str):
+    now = time.monotonic()
+    with _replay_checked_at_lock:
+        _replay_checked_at[url] = now
+        _replay_checked_at.move_to_end(url)
+        while _replay_checked_at:
+            oldest_url, checked_at = next(iter(_replay_checked_at.items()))
+            if now - checked_at <= REPLAY_CHECK_TTL and len(_replay_checked_at) <= REPLAY_CHECK_MAXSIZE:
+                break
+            del _replay_checked_at[oldest_url]
+
+
+def resolve_replay_url(match_id: int) -> str:
+    """URL of the match replay on Valve servers, found with OpenDota and checked to exist"""
+    cluster, replay_salt = fetch_replay_info(match_id)
+    url = f'http://replay{cluster}.valve.net/570/{match_id}_{replay_salt}.dem.bz2'
+    logger.info(url)
+
+    with _replay_checked_at_lock:
+        checked_at = _replay_checked_at.get(url)
+    # The HEAD request runs outside the lock, a concurrent duplicate check is harmless
+    if checked_at is None or time.monotonic() - checked_at > REPLAY_CHECK_TTL:
+        r = SESSION.head(url, timeout=5)
+        r.raise_for_status()
+        remember_replay_check(url)
+    return url
+
+
+def try_resolve_replay_url(match_id: int) -> tuple[str | None, str | None]:
+    """(url, None) on success or (None, error) if the replay can't be found"""
+    try:
+        return resolve_replay_url(match_id), None
+    except (requests.RequestException, ReplayNotFoundError) as err:
+        return None, str(err)
+
 
 @app.route('/')
 def index() -> str:
@@ -26,34 +99,11 @@ def retrive(match_id: int) -> Response:
             error='Match ID is not a number'
         )), 400
 
-    r = requests.get(
-        'https://api.opendota.com/api/replays/',
-        params=dict(match_id=match_id)
-    )
-    try:
-        r.raise_for_status()
-        if not r.json():
-            raise Exception(f'Replay not found for the Match ID: {match_id}')
-    except Exception as err:
-        return jsonify(dict(
-            success=False,
-            error=str(err),
-        )), 404
-
-    replay = r.json()
-    cluster = replay[0]['cluster']
-    match_id = replay[0]['match_id']
-    replay_salt = replay[0]['replay_salt']
-    url = f'http://replay{cluster}.valve.net/570/{match_id}_{replay_salt}.dem.bz2'
-    logger.info(url)
-
-    r = requests.head(url)
-    try:
-        r.raise_for_status()
-    except Exception as err:
+    url, error = try_resolve_replay_url(match_id)
+    if error is not None:
         return jsonify(dict(
             success=False,
-            error=str(err),
+            error=error,
         )), 404
 
     return jsonify(dict(
@@ -88,7 +138,23 @@ def parse() -> Response:
 @app.route('/job/<job_id>')
 def get_job(job_id: str) -> Response:
     task = celery_app.AsyncResult(job_id)
-    details = task.get()
+    # The Redis result backend already waits on the task meta pub/sub channel, get() doesn't poll.
+    # Unknown and lost ids stay PENDING forever, so the wait is bounded
+    try:
+        details = task.get(timeout=JOB_WAIT_TIMEOUT, propagate=False)
+    except JobTimeoutError:
+        return jsonify(dict(
+            success=True,
+            status='pending',
+            job_id=job_id,
+        )), 202
+
+    if task.failed():
+        logger.error(f'Job {job_id} failed: {details!r}')
+        return jsonify(dict(
+            success=False,
+            error=f'{type(details).__name__}: {details}',
+        )), 500
     return jsonify(details)
 
 
@@ -106,17 +172,23 @@ def get_highlights(match_id: int) -> Response:
             error='Match ID is not a number'
         )), 400
 
-    try:
-        match = Match.from_id(match_id)
-        match.parse()
-    except NotParsedError as err:
-        return jsonify(dict(
-            success=False,
-            error=str(err)
-        )), 404
+    # Cached highlights are served right away, otherwise workers compute them for /job/<job_id>
+    if os.path.exists(os.path.join(REPLAY_DIR, f'{match_id}.jsonlines')):
+        highlights = get_cached_highlights(match_id)
+        if highlights is not None:
+            return Response(highlights, mimetype='application/json')
+        job_id = start_highlights_job(match_id)
+    else:
+        url, error = try_resolve_replay_url(match_id)
+        if error is not None:
+            return jsonify(dict(
+                success=False,
+                error=error,
+            )), 404
+        job_id = start_highlights_job(match_id, url)
 
-    action_moments = match.get_action_moments()
     return jsonify(dict(
         success=True,
-        data=action_moments,
-    ))
+        status='pending',
+        job_id=job_id,
+    )), 202
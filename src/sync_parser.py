@@ -1,20 +1,11 @@
 import os
 import time
-import requests
 import subprocess
-from bz2 import decompress
 
 from loguru import logger
 
 from settings import REPLAY_DIR
-
-
-def download(url: str) -> bytes:
-    r = requests.get(url)
-    r.raise_for_status()
-    compressed_dem = r.content
-    dem = decompress(compressed_dem)
-    return dem
+from downloads import download_to
 
 
 def download_save(url: str) -> str:
@@ -23,11 +14,8 @@ def download_save(url: str) -> str:
     file_name = match_salt.split('_')[0]
     file_name += '.dem'
 
-    dem = download(url)
     path = os.path.join(REPLAY_DIR, file_name)
-    with open(path, 'wb') as fout:
-        fout.write(dem)
-    return path
+    return download_to(url, path)
 
 
 def download_parse_save(url: str) -> str:
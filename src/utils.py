@@ -1,13 +1,15 @@
 import logging
+import re
+from itertools import chain
 from typing import Any, List, Dict, Tuple
 
-import requests
 import pandas as pd
 import numpy as np
 from tenacity import retry, stop_after_attempt, wait_fixed
 from loguru import logger
 
 import dota
+from downloads import SESSION
 from settings import HP_RATE_THRESHOLD, MAX_HP_THRESHOLD
 
 
@@ -27,26 +29,37 @@ class EmptyDebugLogger(logging.Logger):
         pass
 
 
+WHITESPACE_RE = re.compile(r'\s+')
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
 def query_opendota(sql: str, **kwargs: dict) -> List[Dict]:
     query = sql.format(**kwargs)
     logger.debug(query)
-    query = query.replace('\n', ' ').replace('\t', ' ')
-    query = ' '.join(word for word in query.split(' ') if word)
+    query = WHITESPACE_RE.sub(' ', query).strip()
 
-    r = requests.get('https://api.opendota.com/api/explorer', params=dict(sql=query))
+    r = SESSION.get('https://api.opendota.com/api/explorer', params=dict(sql=query))
     r.raise_for_status()
     result = r.json()
     rows = result['rows']
     return rows
 
 
+def _sorted_time_slice(times: np.ndarray, start_time: int = None, end_time: int = None) -> slice:
+    """Positions of sorted times within [start_time, end_time] as a slice"""
+    lo = 0 if start_time is None else np.searchsorted(times, start_time, side='left')
+    hi = len(times) if end_time is None else np.searchsorted(times, end_time, side='right')
+    return slice(lo, hi)
+
+
 class TimeSeries(pd.Series):
     def __init__(self, *args: Tuple, **kwargs: Dict):
         super().__init__(*args, **kwargs)
 
     def t(self, start_time: int = None, end_time: int = None) -> pd.Series:
-        if start_time is not None and end_time is not None:
+        if self.index.is_monotonic_increasing:
+            series = self.iloc[_sorted_time_slice(self.index.to_numpy(), start_time, end_time)]
+        elif start_time is not None and end_time is not None:
             series = self[(self.index >= start_time) & (self.index <= end_time)]
         elif start_time is not None and end_time is None:
             series = self[(self.index >= start_time)]
@@ -58,13 +71,29 @@ class TimeSeries(pd.Series):
 
 
 class TimeTable(pd.DataFrame):
+    # Internal, so the cached check is neither a column nor copied to derived frames by __finalize__
+    _internal_names = pd.DataFrame._internal_names + ['_sorted_times']
+    _internal_names_set = set(_internal_names)
+
     def __init__(self, *args: Tuple, **kwargs: Dict):
         super().__init__(*args, **kwargs)
         if 'time' not in self.columns:
             self['time'] = np.nan
 
+    def is_time_sorted(self) -> bool:
+        """time.is_monotonic_increasing, scanned once per version of the column"""
+        times = self['time']
+        # pandas hands out a new Series from its item cache whenever the column is modified through the frame
+        cached = getattr(self, '_sorted_times', None)
+        if cached is None or cached[0] is not times:
+            cached = (times, times.is_monotonic_increasing)
+            self._sorted_times = cached
+        return cached[1]
+
     def t(self, start_time: int = None, end_time: int = None) -> pd.DataFrame:
-        if start_time is not None and end_time is not None:
+        if self.is_time_sorted():
+            df = self.iloc[_sorted_time_slice(self['time'].to_numpy(), start_time, end_time)]
+        elif start_time is not None and end_time is not None:
             df = self[(self['time'] >= start_time) & (self['time'] <= end_time)]
         elif start_time is not None and end_time is None:
             df = self[(self['time'] >= start_time)]
@@ -74,33 +103,35 @@ class TimeTable(pd.DataFrame):
             df = self
         return TimeTable(df)
 
+    @classmethod
+    def from_intervals(cls: 'TimeTable', intervals: np.ndarray) -> 'TimeTable':
+        """Table from an (N, 2) array of [start, end] rows"""
+        df = cls(intervals, columns=['start', 'end'])
+        df['time'] = df['start']
+        return df
+
 
 def convert_binary_mask_to_intervals(binary_mask: TimeSeries) -> List[Dict]:
-    if binary_mask.empty:
+    return convert_flags_to_intervals(binary_mask.index.to_numpy(), binary_mask.to_numpy(dtype=bool))
+
+
+def convert_flags_to_intervals(times: np.ndarray, flags: np.ndarray) -> List[Dict]:
+    """convert_binary_mask_to_intervals for raw arrays of times and boolean flags"""
+    if len(flags) == 0:
         return []
 
-    intervals = [dict()]
-    prev_flag = False
-    for time, flag in binary_mask.items():
-        last_interval = intervals[-1]
-        if flag is True and prev_flag is False:
-            last_interval['start'] = time
-        if flag is False and prev_flag is True:
-            last_interval['end'] = time
-            intervals.append(dict())
-        prev_flag = flag
-
-    last_interval = intervals[-1]
-    if not last_interval:
-        intervals.pop()
-
-    if 'start' in last_interval and 'end' not in last_interval:
-        series_last_time = binary_mask.index[-1]
-        if last_interval['start'] != series_last_time:
-            last_interval['end'] = series_last_time
+    # XOR with the mask shifted by one marks every flip, flips alternate between starts and ends
+    flips = np.flatnonzero(flags ^ np.r_[False, flags[:-1]])
+    starts = flips[0::2]
+    ends = flips[1::2]
+
+    # An interval still open at the end is closed by the last time, unless it starts there
+    if len(starts) > len(ends):
+        if times[starts[-1]] != times[-1]:
+            ends = np.append(ends, len(times) - 1)
         else:
-            intervals.pop()
-    return intervals
+            starts = starts[:-1]
+    return [dict(start=start, end=end) for start, end in zip(times[starts].tolist(), times[ends].tolist())]
 
 
 def merge_close_intervals(intervals: List[Dict], gap: int) -> List[Dict]:
@@ -110,27 +141,74 @@ def merge_close_intervals(intervals: List[Dict], gap: int) -> List[Dict]:
     if len(intervals) < 2:
         return intervals
 
-    intervals = sorted(intervals, key=lambda dct: (dct['start'], dct['end']))
-    merged = []
-    prev = intervals[0]
-    for current in intervals[1:]:
-        if current['start'] <= (prev['end'] + gap):
-            prev = dict(
-                start=prev['start'],
-                end=max(current['end'], prev['end'])
-            )
-        else:
-            merged.append(prev)
-            prev = current
-    if not merged or merged[-1] != prev:
-        merged.append(prev)
-    return merged
+    merged = merge_close_intervals_array(_dicts_to_array(intervals), gap)
+    return [dict(start=start, end=end) for start, end in merged.tolist()]
+
+
+def to_interval_array(df: pd.DataFrame) -> np.ndarray:
+    """(N, 2) array of [start, end] rows"""
+    if df.empty:
+        return np.empty((0, 2), dtype=np.int64)
+    return df[['start', 'end']].to_numpy()
+
+
+def _dicts_to_array(intervals: List[Dict]) -> np.ndarray:
+    return np.array([(interval['start'], interval['end']) for interval in intervals]).reshape(-1, 2)
+
+
+def merge_close_intervals_array(intervals: np.ndarray, gap: int) -> np.ndarray:
+    """
+    merge_close_intervals for an (N, 2) array of [start, end] rows
+    """
+    if len(intervals) < 2:
+        return intervals
+
+    intervals = intervals[np.lexsort((intervals[:, 1], intervals[:, 0]))]
+    starts = intervals[:, 0]
+    ends = intervals[:, 1]
+    # A group starts where the interval begins after every previous interval ended (plus gap)
+    is_group_start = np.r_[True, starts[1:] > np.maximum.accumulate(ends)[:-1] + gap]
+    group_starts = np.flatnonzero(is_group_start)
+    return np.column_stack((starts[group_starts], np.maximum.reduceat(ends, group_starts)))
+
+
+def rolling_max_bfill(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Same as series.rolling(window).max().fillna(method='bfill') on a NaN-free array
+    """
+    n = len(values)
+    result = np.full(n, np.nan)
+    if n < window:
+        return result
+
+    # van Herk/Gil-Werman: a window spans at most two blocks of its own size, so its max is
+    # the suffix max in the first block and the prefix max in the second one, O(N) for any window
+    blocks = np.full(-(-n // window) * window, -np.inf)
+    blocks[:n] = values
+    blocks = blocks.reshape(-1, window)
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    result[window - 1:] = np.maximum(suffix[:n - window + 1], prefix[window - 1:n])
+    result[:window - 1] = result[window - 1]
+    return result
+
+
+def rolling_mean_bfill(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Same as series.rolling(window).mean().fillna(method='bfill') on a NaN-free array
+    """
+    result = np.full(len(values), np.nan)
+    if len(values) < window:
+        return result
+    result[window - 1:] = np.lib.stride_tricks.sliding_window_view(values, window).mean(axis=1)
+    result[:window - 1] = result[window - 1]
+    return result
 
 
 def has_intersection(interval1: Dict, interval2: Dict, gap: int = 0) -> bool:
     """By default gap = 0, checks for strict intersection"""
-    merged = merge_close_intervals([interval1, interval2], gap)
-    return len(merged) < 2
+    # Two intervals merge when each one starts no later than the other ends plus gap
+    return interval1['start'] <= interval2['end'] + gap and interval2['start'] <= interval1['end'] + gap
 
 
 def get_intersection(interval1: Dict, interval2: Dict) -> Dict | None:
@@ -145,32 +223,35 @@ def get_intersection(interval1: Dict, interval2: Dict) -> Dict | None:
     return intersection
 
 
+def _intersections_array(intervals1: np.ndarray, intervals2: np.ndarray) -> np.ndarray:
+    """Pairwise intersections of two (N, 2) arrays, ordered by the first then the second interval start"""
+    intervals1 = intervals1[np.argsort(intervals1[:, 0], kind='stable')]
+    intervals2 = intervals2[np.argsort(intervals2[:, 0], kind='stable')]
+    starts = np.maximum.outer(intervals1[:, 0], intervals2[:, 0])
+    ends = np.minimum.outer(intervals1[:, 1], intervals2[:, 1])
+    rows, columns = np.nonzero(starts <= ends)
+    return np.column_stack((starts[rows, columns], ends[rows, columns]))
+
+
 def get_intersections(intervals1: List[Dict], intervals2: List[Dict]) -> List[Dict]:
-    intersections = []
-    intervals1 = sorted(intervals1, key=lambda dct: dct['start'])
-    intervals2 = sorted(intervals2, key=lambda dct: dct['start'])
-    for i1 in intervals1:
-        for i2 in intervals2:
-            if i2['start'] > i1['end']:
-                break
-            intersection = get_intersection(i1, i2)
-            if intersection:
-                intersections.append(intersection)
-    return intersections
+    intersections = _intersections_array(_dicts_to_array(intervals1), _dicts_to_array(intervals2))
+    return [dict(start=start, end=end) for start, end in intersections.tolist()]
 
 
 def calculate_iou(intervals1: List[Dict], intervals2: List[Dict]) -> float:
     """Calculates Intersection over Union for intervals"""
-    intersections = get_intersections(intervals1, intervals2)
-    union = merge_close_intervals(intervals1 + intervals2, gap=0)
-    total_intersection = sum([i['end'] - i['start'] for i in intersections])
-    total_union = sum([i['end'] - i['start'] for i in union])
+    intervals1 = _dicts_to_array(intervals1)
+    intervals2 = _dicts_to_array(intervals2)
+    intersections = _intersections_array(intervals1, intervals2)
+    union = merge_close_intervals_array(np.concatenate((intervals1, intervals2)), gap=0)
+    total_intersection = (intersections[:, 1] - intersections[:, 0]).sum().item()
+    total_union = (union[:, 1] - union[:, 0]).sum().item()
     iou = total_intersection / total_union
     return iou
 
 
 def flatten(list_of_lists: List) -> List:
-    return [item for sublist in list_of_lists for item in sublist]
+    return list(chain.from_iterable(list_of_lists))
 
 
 def convert_to_dota_clock_format(seconds: int) -> str:
@@ -179,6 +260,16 @@ def convert_to_dota_clock_format(seconds: int) -> str:
     return f'{minutes}:{secs}'
 
 
+def convert_to_dota_clock_format_vec(seconds: np.ndarray) -> np.ndarray:
+    """Vectorized convert_to_dota_clock_format over an array of seconds"""
+    seconds = np.asarray(seconds)
+    if seconds.size == 0:
+        return np.array([], dtype=str)
+    minutes = np.char.mod('%02d', seconds // 60)
+    secs = np.char.mod('%02d', seconds % 60)
+    return np.char.add(np.char.add(minutes, ':'), secs)
+
+
 def plot_player_signals(
     player: 'dota.MatchPlayer',
     ax: Any = None,
@@ -210,36 +301,40 @@ def plot_player_signals(
 ):
     denominator = 60 if use_minutes else 1
     if hp:
+        series = player.hp.t(zoom_start, zoom_end)
         ax.plot(
-            player.hp.t(zoom_start, zoom_end).index / denominator,
-            player.hp.t(zoom_start, zoom_end),
+            series.index / denominator,
+            series,
             label='hp',
         )
 
     if max_hp:
+        series = player.max_hp.t(zoom_start, zoom_end)
         ax.plot(
-            player.max_hp.t(zoom_start, zoom_end).index / denominator,
-            player.max_hp.t(zoom_start, zoom_end),
+            series.index / denominator,
+            series,
             label='max_hp',
         )
 
     if dhp:
+        series = player.dhp.t(zoom_start, zoom_end)
         ax.plot(
-            player.dhp.t(zoom_start, zoom_end).index / denominator,
-            player.dhp.t(zoom_start, zoom_end),
+            series.index / denominator,
+            series,
             label='dhp',
         )
 
     if sdhp:
+        series = player.sdhp.t(zoom_start, zoom_end)
         ax.plot(
-            player.sdhp.t(zoom_start, zoom_end).index / denominator,
-            player.sdhp.t(zoom_start, zoom_end),
+            series.index / denominator,
+            series,
             label='sdhp',
         )
 
     if signal_hp_decreasing:
-        binary_mask = player.sdhp.t(zoom_start, zoom_end) < HP_RATE_THRESHOLD
         hp = player.hp.t(zoom_start, zoom_end)
+        binary_mask = player.sdhp.t(zoom_start, zoom_end) < HP_RATE_THRESHOLD
         hp = hp[binary_mask]
         ax.scatter(
             hp.index / denominator,
@@ -250,9 +345,8 @@ def plot_player_signals(
         )
 
     if signal_hp_low:
-        hp_relative = player.hp.t(zoom_start, zoom_end) / player.max_hp.t(zoom_start, zoom_end)
-        binary_mask = hp_relative < MAX_HP_THRESHOLD
         hp = player.hp.t(zoom_start, zoom_end)
+        binary_mask = hp / player.max_hp.t(zoom_start, zoom_end) < MAX_HP_THRESHOLD
         hp = hp[binary_mask]
         ax.scatter(
             hp.index / denominator,
@@ -263,173 +357,59 @@ def plot_player_signals(
         )
 
     if deaths:
+        df_deaths = player.deaths.t(zoom_start, zoom_end)
         ax.scatter(
-            player.deaths.t(zoom_start, zoom_end)['time'] / denominator,
-            np.full(player.deaths.t(zoom_start, zoom_end).shape[0], deaths_line_level),
+            df_deaths['time'] / denominator,
+            np.broadcast_to(np.float64(deaths_line_level), df_deaths.shape[0]),
             label='death',
             color='r',
             marker='v',
             s=100,
         )
 
-    if as_target:
-        x1 = player.as_target.t(zoom_start, zoom_end)['start'] / denominator
-        y1 = np.full(player.as_target.t(zoom_start, zoom_end)['start'].shape[0], as_target_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='as_target',
-            color='y',
-            marker='$[$',
-            s=100,
-        )
-        x2 = player.as_target.t(zoom_start, zoom_end)['end'] / denominator
-        y2 = np.full(player.as_target.t(zoom_start, zoom_end)['end'].shape[0], as_target_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='as_target',
-            color='y',
-            marker='$]$',
-            s=100,
-        )
-
-    if as_target_escaped:
-        df_target = player.as_target.t(zoom_start, zoom_end)
-        df_target = df_target[~df_target['target_dead']]
-        x1 = df_target['start'] / denominator
-        y1 = np.full(df_target['start'].shape[0], as_target_escaped_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='as_target_escaped',
-            color='g',
-            marker='$[$',
-            s=100,
-        )
-        x2 = df_target['end'] / denominator
-        y2 = np.full(df_target['end'].shape[0], as_target_escaped_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='as_target_escaped',
-            color='g',
-            marker='$]$',
-            s=100,
-        )
-
-    if as_attacker:
-        x1 = player.as_attacker.t(zoom_start, zoom_end)['start'] / denominator
-        y1 = np.full(player.as_attacker.t(zoom_start, zoom_end)['start'].shape[0], as_attacker_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='as_attacker',
-            color='b',
-            marker='$[$',
-            s=100,
-        )
-        x2 = player.as_attacker.t(zoom_start, zoom_end)['end'] / denominator
-        y2 = np.full(player.as_attacker.t(zoom_start, zoom_end)['end'].shape[0], as_attacker_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='as_attacker',
-            color='b',
-            marker='$]$',
-            s=100,
-        )
-
-    if as_attacker_kill:
-        df_attacker = player.as_attacker.t(zoom_start, zoom_end)
-        df_attacker = df_attacker[~df_attacker['target_dead']]
-        x1 = df_attacker['start'] / denominator
-        y1 = np.full(df_attacker['start'].shape[0], as_attacker_kill_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='as_attacker_kill',
-            color='r',
-            marker='$[$',
-            s=100,
-        )
-        x2 = df_attacker['end'] / denominator
-        y2 = np.full(df_attacker['end'].shape[0], as_attacker_kill_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='as_attacker_kill',
-            color='r',
-            marker='$]$',
-            s=100,
-        )
-
-    if action_moments:
-        df_moments= player.action_moments.t(zoom_start, zoom_end)
-        x1 = df_moments['start'] / denominator
-        y1 = np.full(df_moments['start'].shape[0], action_moments_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='action_moments',
-            color='gray',
-            marker='$[$',
-            s=100,
-        )
-        x2 = df_moments['end'] / denominator
-        y2 = np.full(df_moments['end'].shape[0], action_moments_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='action_moments',
-            color='gray',
-            marker='$]$',
-            s=100,
-        )
-    
-    if match_action_moments:
-        df_moments= player.match.action_moments.t(zoom_start, zoom_end)
-        x1 = df_moments['start'] / denominator
-        y1 = np.full(df_moments['start'].shape[0], match_action_moments_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='match_action_moments',
-            color='black',
-            marker='$[$',
-            s=100,
-        )
-        x2 = df_moments['end'] / denominator
-        y2 = np.full(df_moments['end'].shape[0], match_action_moments_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='match_action_moments',
-            color='black',
-            marker='$]$',
-            s=100,
-        )
+    # (enabled, label, source table, keep only alive targets, line level, color)
+    interval_signals = (
+        (as_target, 'as_target', 'as_target', False, as_target_line_level, 'y'),
+        (as_target_escaped, 'as_target_escaped', 'as_target', True, as_target_escaped_line_level, 'g'),
+        (as_attacker, 'as_attacker', 'as_attacker', False, as_attacker_line_level, 'b'),
+        (as_attacker_kill, 'as_attacker_kill', 'as_attacker', True, as_attacker_kill_line_level, 'r'),
+        (action_moments, 'action_moments', 'action_moments', False, action_moments_line_level, 'gray'),
+        (
+            match_action_moments, 'match_action_moments', 'match_action_moments', False,
+            match_action_moments_line_level, 'black',
+        ),
+        (df_youtube is not None, 'youtube', 'youtube', False, youtube_line_level, 'purple'),
+    )
+    # Tables are computed lazily and sliced once even if several signals share them
+    tables = dict(
+        as_target=lambda: player.as_target,
+        as_attacker=lambda: player.as_attacker,
+        action_moments=lambda: player.action_moments,
+        match_action_moments=lambda: player.match.action_moments,
+        youtube=lambda: df_youtube,
+    )
+    sliced = dict()
+    for enabled, label, table, alive_target_only, line_level, color in interval_signals:
+        if not enabled:
+            continue
+        if table not in sliced:
+            sliced[table] = tables[table]().t(zoom_start, zoom_end)
+        df = sliced[table]
+        starts = df['start'].to_numpy()
+        ends = df['end'].to_numpy()
+        if alive_target_only:
+            alive = ~df['target_dead'].to_numpy(dtype=bool)
+            starts, ends = starts[alive], ends[alive]
+        # Constant level as a read-only view, no array is filled
+        y = np.broadcast_to(np.float64(line_level), len(starts))
+        for times, marker in ((starts, '$[$'), (ends, '$]$')):
+            ax.scatter(
+                times / denominator,
+                y,
+                label=label,
+                color=color,
+                marker=marker,
+                s=100,
+            )
 
-    if df_youtube is not None:
-        df_moments = df_youtube.t(zoom_start, zoom_end)
-        x1 = df_moments['start'] / denominator
-        y1 = np.full(df_moments['start'].shape[0], youtube_line_level)
-        ax.scatter(
-            x1,
-            y1,
-            label='youtube',
-            color='purple',
-            marker='$[$',
-            s=100,
-        )
-        x2 = df_moments['end'] / denominator
-        y2 = np.full(df_moments['end'].shape[0], youtube_line_level)
-        ax.scatter(
-            x2,
-            y2,
-            label='youtube',
-            color='purple',
-            marker='$]$',
-            s=100,
-        )
     ax.legend()
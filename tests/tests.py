@@ -1,16 +1,30 @@
 import os
-import time
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Dict
 
-# import numpy as np
+import numpy as np
+import pandas as pd
 import requests
 from loguru import logger
 
+import dota  # noqa F401, resolves the dota <-> attacks import cycle
+from attacks import find_attacks, find_low_and_decreasing_hp_intervals
+from dota import EventColumns, read_jsonlines
 from settings import (
     # FRAMES_DIR,
+    DHP_SMOOTH_WINDOW,
     REPLAY_DIR,
 )
+from utils import (
+    TimeTable,
+    _intersections_array,
+    convert_flags_to_intervals,
+    merge_close_intervals,
+    merge_close_intervals_array,
+    rolling_max_bfill,
+    rolling_mean_bfill,
+)
 # from youtube import sample_frames
 
 
@@ -18,15 +32,19 @@ def test_pytest():
     assert True
 
 
-def test_api(test_highlights_response: Dict):
-    # FIXME: Use celery status job_id instead of timeouts
+def wait_job(host_port: str, job_id: str) -> requests.Response:
+    # /job answers 202 while the job is still running
+    while True:
+        r = requests.get(f'{host_port}/job/{job_id}')
+        if r.status_code != 202:
+            return r
 
+
+def test_api(test_highlights_response: Dict):
     host_port = 'http://localhost:8000'
     match_id = 6676393091
     jsonlines = f'{match_id}.jsonlines'
-    demfile = f'{match_id}.dem'
     path_jsonlines = Path(REPLAY_DIR) / jsonlines
-    path_demfile = Path(REPLAY_DIR) / demfile
 
     if path_jsonlines.exists():
         os.remove(path_jsonlines)
@@ -38,18 +56,189 @@ def test_api(test_highlights_response: Dict):
 
     logger.info('Test Parser')
     r = requests.get(f'{host_port}/parse', params=dict(url=url))
-
-    time.sleep(20)
-    for _ in range(7):
-        if path_demfile.exists():
-            time.sleep(10)
+    job_id = r.json()['job_id']
+    r = wait_job(host_port, job_id)
+    r.raise_for_status()
+    assert path_jsonlines.exists()
 
     logger.info('Test Highlights')
     r = requests.get(f'{host_port}/getHighlights/{match_id}')
+    assert r.status_code == 202
+    job_id = r.json()['job_id']
+    r = wait_job(host_port, job_id)
     response = r.json()
     assert response == test_highlights_response
 
 
+def stub_player(
+    times: np.ndarray,
+    sdhp: np.ndarray,
+    hp: np.ndarray,
+    death_times: list,
+    damage_times: list,
+    damage_sources: list,
+) -> SimpleNamespace:
+    """The MatchPlayer attributes find_attacks reads, attacker heroes resolve to their names"""
+    return SimpleNamespace(
+        match=SimpleNamespace(get_player=lambda hero_name: hero_name),
+        sdhp=pd.Series(sdhp, index=times),
+        hp=pd.Series(hp, index=times),
+        max_hp=pd.Series(1000, index=times),
+        deaths=pd.DataFrame({'time': death_times}, dtype=np.int64),
+        hero_damage_in=pd.DataFrame({'time': damage_times, 'sourcename': damage_sources}),
+    )
+
+
+def test_find_attacks_overlapping_low_hp():
+    # One decreasing hp interval covering two separate low hp intervals
+    times = np.arange(60)
+    sdhp = np.where((times >= 10) & (times <= 40), -30, 0)
+    hp = np.where(((times >= 12) & (times <= 18)) | ((times >= 30) & (times <= 36)), 100, 900)
+    player = stub_player(times, sdhp, hp, [40], [35, 11, 50], ['axe', 'lina', 'pudge'])
+
+    intervals = find_attacks(player)
+    assert len(intervals) == 1
+    assert intervals[0]['start'] == 10 - DHP_SMOOTH_WINDOW
+    assert intervals[0]['end'] == 41 - DHP_SMOOTH_WINDOW  # end is the first sample past the run
+    assert intervals[0]['target_dead']
+    assert intervals[0]['attacker_heroes'] == ['lina', 'axe']
+
+
+def test_find_attacks_matches_masks():
+    rng = np.random.default_rng(0)
+    heroes = np.array(['axe', 'lina', 'pudge', 'sven'])
+    for _ in range(20):
+        times = np.arange(300)
+        sdhp = np.where(rng.random(300) < 0.4, -30, 0)
+        hp = np.where(rng.random(300) < 0.3, 100, 900)
+        death_times = rng.integers(0, 300, 3).tolist()
+        damage_times = rng.integers(0, 300, 40).tolist()
+        damage_sources = heroes[rng.integers(0, len(heroes), 40)].tolist()
+        player = stub_player(times, sdhp, hp, death_times, damage_times, damage_sources)
+
+        # Unsorted events filtered with a mask per interval
+        expected = []
+        for interval in find_low_and_decreasing_hp_intervals(player):
+            start, end = interval['start'], interval['end']
+            deaths = player.deaths[player.deaths['time'].between(start, end)]
+            damage_in = player.hero_damage_in[player.hero_damage_in['time'].between(start, end)]
+            expected.append(dict(
+                start=start - DHP_SMOOTH_WINDOW,
+                end=end - DHP_SMOOTH_WINDOW,
+                target_dead=not deaths.empty,
+                attacker_heroes=list(damage_in.sort_values('time', kind='stable')['sourcename'].unique()),
+            ))
+        assert find_attacks(player) == expected
+
+
+def test_as_target_without_attacks():
+    times = np.arange(60)
+    player = stub_player(times, np.zeros(60), np.full(60, 900), [], [], [])
+    df = dota.MatchPlayer.as_target.func(player)
+    assert df.empty
+    assert {'start', 'end', 'target_dead', 'attacker_heroes', 'time', 'target'} <= set(df.columns)
+    # plot_player_signals slices the table and reads the interval bounds
+    assert df.t(0, 30)['start'].empty
+
+
+def test_time_table_t():
+    df = TimeTable({'time': [1, 3, 5, 7], 'value': [10, 30, 50, 70]})
+    assert df.is_time_sorted()
+    assert df.t(2, 5)['value'].tolist() == [30, 50]
+    # Writes through the frame invalidate the cached sortedness
+    df.loc[0, 'time'] = 6
+    assert not df.is_time_sorted()
+    assert df.t(2, 6)['value'].tolist() == [10, 30, 50]
+    df['time'] = [0, 2, 4, 6]
+    assert df.is_time_sorted()
+    assert df.t(None, 3)['value'].tolist() == [10, 30]
+
+
+def test_rolling_bfill():
+    values = np.random.default_rng(0).integers(0, 1000, 57).astype(float)
+    for n in (0, 1, 2, 10, 57):
+        for window in (1, 3, 7, 20):
+            series = pd.Series(values[:n])
+            expected_max = series.rolling(window).max().fillna(method='bfill').to_numpy()
+            expected_mean = series.rolling(window).mean().fillna(method='bfill').to_numpy()
+            np.testing.assert_allclose(rolling_max_bfill(values[:n], window), expected_max, equal_nan=True)
+            np.testing.assert_allclose(rolling_mean_bfill(values[:n], window), expected_mean, equal_nan=True)
+
+
+def test_convert_flags_to_intervals():
+    times = np.arange(10, 15)
+    assert convert_flags_to_intervals(np.array([]), np.array([], dtype=bool)) == []
+    assert convert_flags_to_intervals(times, np.zeros(5, dtype=bool)) == []
+    assert convert_flags_to_intervals(times, np.ones(5, dtype=bool)) == [dict(start=10, end=14)]
+    flags = np.array([False, True, True, False, False])
+    assert convert_flags_to_intervals(times, flags) == [dict(start=11, end=13)]
+    # Trailing open interval is closed by the last time
+    flags = np.array([True, False, False, True, True])
+    assert convert_flags_to_intervals(times, flags) == [dict(start=10, end=11), dict(start=13, end=14)]
+    # Unless it only starts at the last time
+    flags = np.array([False, True, False, False, True])
+    assert convert_flags_to_intervals(times, flags) == [dict(start=11, end=12)]
+
+
+def test_merge_close_intervals_array():
+    empty = np.empty((0, 2), dtype=np.int64)
+    assert merge_close_intervals_array(empty, 2).shape == (0, 2)
+    single = np.array([[3, 4]])
+    assert merge_close_intervals_array(single, 2).tolist() == [[3, 4]]
+
+    # Unsorted, overlapping and nested intervals
+    intervals = np.array([[10, 12], [0, 5], [3, 4], [7, 8]])
+    assert merge_close_intervals_array(intervals, 2).tolist() == [[0, 12]]
+    assert merge_close_intervals_array(intervals, 1).tolist() == [[0, 5], [7, 8], [10, 12]]
+    assert merge_close_intervals_array(intervals, 0).tolist() == [[0, 5], [7, 8], [10, 12]]
+    dicts = [dict(start=start, end=end) for start, end in intervals.tolist()]
+    assert merge_close_intervals(dicts, 1) == [dict(start=0, end=5), dict(start=7, end=8), dict(start=10, end=12)]
+
+
+def test_intersections_array():
+    intervals1 = np.array([[8, 12], [0, 5]])
+    intervals2 = np.array([[12, 15], [4, 9], [20, 21]])
+    assert _intersections_array(intervals1, intervals2).tolist() == [[4, 5], [8, 9], [12, 12]]
+    empty = np.empty((0, 2), dtype=np.int64)
+    assert _intersections_array(empty, intervals2).shape == (0, 2)
+    assert _intersections_array(intervals1, empty).shape == (0, 2)
+    assert _intersections_array(intervals1, np.array([[6, 7]])).shape == (0, 2)
+
+
+def test_read_jsonlines(tmp_path: Path):
+    path = tmp_path / 'events.jsonlines'
+    path.write_bytes(b'')
+    assert list(read_jsonlines(path)) == []
+
+    # Blank lines are skipped, the last line may lack a line break
+    path.write_bytes(b'{"time": 1}\n\n{"time": 2, "type": "interval"}\n{"time": 3}')
+    assert list(read_jsonlines(path)) == [dict(time=1), dict(time=2, type='interval'), dict(time=3)]
+
+
+def test_event_columns():
+    event_columns = EventColumns()
+    event_columns.append(dict(time=5, type='interval', unit='npc_dota_hero_axe', hp=700))
+    event_columns.append(dict(
+        time=6,
+        type='DOTA_COMBATLOG_DAMAGE',
+        sourcename='npc_dota_hero_lina',
+        targetsourcename='npc_dota_hero_axe',
+        targethero=True,
+        attackerhero=True,
+    ))
+    columns = event_columns.to_numpy()
+    categories = event_columns.categories()
+
+    assert columns['time'].tolist() == [5, 6]
+    assert columns['hp'].tolist() == [700, 0]
+    assert columns['targethero'].tolist() == [False, True]
+    assert columns['targetillusion'].tolist() == [False, False]
+    assert categories['type'][columns['type']].tolist() == ['interval', 'DOTA_COMBATLOG_DAMAGE']
+    assert categories['unit'][columns['unit']].tolist() == ['npc_dota_hero_axe', None]
+    assert categories['sourcename'][columns['sourcename']].tolist() == [None, 'npc_dota_hero_lina']
+    assert categories['targetsourcename'][columns['targetsourcename']].tolist() == [None, 'npc_dota_hero_axe']
+
+
 def test_youtube_download(video_url: str):
     # download_ranges
     pass